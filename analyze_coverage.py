@@ -7,6 +7,9 @@ Analyzes what percentage of each state is covered by ZIP3 polygons
 import geopandas as gpd
 import pandas as pd
 
+from state_areas import get_state_areas
+from zip3_common import area_by_state
+
 def analyze_zip3_coverage():
     """Analyze ZIP3 coverage by state using proper area calculations"""
     print("🔍 ZIP3 Coverage Analysis by State")
@@ -15,23 +18,19 @@ def analyze_zip3_coverage():
     try:
         # Load the dissolved ZIP3-state layer
         print("📂 Loading ZIP3-state dissolved layer...")
-        gdf = gpd.read_file("out/state_zip3_dissolved.gpkg").to_crs(5070)  # equal-area projection
+        gdf = gpd.read_file("out/state_zip3_dissolved.gpkg", engine="pyogrio", use_arrow=True).to_crs(5070)  # equal-area projection
         print(f"   Loaded {len(gdf)} ZIP3-state polygons")
         
-        # Load original state boundaries for comparison
-        print("📂 Loading original state boundaries...")
-        state_bounds = gpd.read_file("state_shp/cb_2018_us_state_500k.shp").to_crs(5070)
-        state_bounds = state_bounds[['STUSPS', 'geometry']].set_index('STUSPS')
-        print(f"   Loaded {len(state_bounds)} state boundaries")
-        
+        # Load original state total areas (cached to CSV after the first run)
+        print("📂 Loading original state areas...")
+        original_state_areas = get_state_areas()
+        print(f"   Loaded {len(original_state_areas)} state areas")
+
         # Calculate areas
         print("📊 Calculating coverage by state...")
-        
-        # Get total ZIP3 area by state (dissolve overlapping ZIP3 polygons)
-        zip3_area_by_state = gdf.dissolve(by="STUSPS").area
-        
-        # Get original state total areas
-        original_state_areas = state_bounds.area
+
+        # Get total ZIP3 area by state (sum when clean, union when overlapping)
+        zip3_area_by_state = area_by_state(gdf)
         
         # Calculate coverage percentage for common states
         common_states = list(set(zip3_area_by_state.index) & set(original_state_areas.index))
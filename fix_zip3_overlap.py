@@ -7,24 +7,44 @@ coverage problem by using 'within' predicate and centroid assignment for
 border-straddling ZIPs, then dissolving by state and ZIP3.
 
 Purpose: Generate clean state-ZIP3 polygons without boundary overshoots
-Output: ./out/state_zip3_trimmed.gpkg and .shp
+Output: ./out/state_zip3_trimmed.gpkg (plus .shp when run with --with-shp)
 """
 
+import hashlib
 import os
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 from pathlib import Path
 import warnings
+
+from state_areas import get_state_areas
+from zip3_common import (
+    IO_ENGINE,
+    OUTPUT_DIR,
+    STATE_BASE_NAME,
+    STATE_DIR,
+    ZCTA_BASE_NAME,
+    area_by_state,
+    extract_zip3,
+    fix_invalid_geometries,
+    read_file,
+)
 warnings.filterwarnings('ignore')
 
 # Configuration
-ZCTA_BASE_NAME = "cb_2018_us_zcta510_500k"
-STATE_DIR = "state_shp"
-STATE_BASE_NAME = "cb_2018_us_state_500k"
-OUTPUT_DIR = "out"
 REFERENCE_GPKG = "out/state_zip3_dissolved.gpkg"
+# Albers Equal Area — the whole pipeline runs in this CRS so that simplify
+# tolerances and the coverage validation share one projection, and we only
+# reproject once on export
+PIPELINE_CRS = "EPSG:5070"
+# Shapefile output doubles the export time and Tableau reads the GeoPackage,
+# so the .shp write is opt-in
+WRITE_SHAPEFILE = "--with-shp" in sys.argv
 
 def check_input_files():
     """Verify all required input files exist"""
@@ -53,7 +73,7 @@ def load_reference_data():
     print("📂 Loading reference data...")
     
     # Load the existing dissolved layer for reference
-    ref_gdf = gpd.read_file(REFERENCE_GPKG)
+    ref_gdf = read_file(REFERENCE_GPKG)
     existing_states = set(ref_gdf['STUSPS'].unique())
     reference_crs = ref_gdf.crs
     
@@ -66,14 +86,13 @@ def load_and_prepare_raw_data(target_crs, existing_states):
     """Load raw ZCTA and state data, prepare for processing"""
     print("📊 Loading raw ZCTA data...")
     
-    # Load ZCTA data
-    zcta_gdf = gpd.read_file(f"{ZCTA_BASE_NAME}.shp")
+    # Load ZCTA data; only GEOID10 is needed, so let pyogrio skip the other
+    # DBF columns instead of reading everything and projecting afterwards
+    zcta_gdf = read_file(f"{ZCTA_BASE_NAME}.shp", columns=['GEOID10'])
     print(f"   Loaded {len(zcta_gdf)} ZCTA polygons")
-    
-    # Keep only required columns and add ZIP3
-    zcta_gdf = zcta_gdf[['GEOID10', 'geometry']].copy()
-    zcta_gdf['ZIP3'] = zcta_gdf['GEOID10'].str[:3]
-    
+
+    zcta_gdf['ZIP3'] = extract_zip3(zcta_gdf['GEOID10'])
+
     # Ensure target CRS
     if zcta_gdf.crs != target_crs:
         print(f"   Reprojecting ZCTA from {zcta_gdf.crs} to {target_crs}")
@@ -81,19 +100,18 @@ def load_and_prepare_raw_data(target_crs, existing_states):
     
     print("📊 Loading state boundary data...")
     state_shp_path = os.path.join(STATE_DIR, f"{STATE_BASE_NAME}.shp")
-    state_gdf = gpd.read_file(state_shp_path)
+    state_gdf = read_file(state_shp_path, columns=['STATEFP', 'STUSPS'])
     print(f"   Loaded {len(state_gdf)} state polygons")
-    
+
     # Filter states to match existing dissolved layer (keep territories if they exist)
     original_count = len(state_gdf)
     state_gdf = state_gdf[state_gdf['STUSPS'].isin(existing_states)].copy()
-    
+
     if len(state_gdf) < original_count:
         removed_states = original_count - len(state_gdf)
         print(f"   ⚠️  Filtered out {removed_states} states/territories not in reference layer")
-    
-    # Keep only required state columns and ensure target CRS
-    state_gdf = state_gdf[['STATEFP', 'STUSPS', 'geometry']].copy()
+
+    # Ensure target CRS
     if state_gdf.crs != target_crs:
         print(f"   Reprojecting states from {state_gdf.crs} to {target_crs}")
         state_gdf = state_gdf.to_crs(target_crs)
@@ -103,72 +121,143 @@ def load_and_prepare_raw_data(target_crs, existing_states):
 def assign_zips_to_states(zcta_gdf, state_gdf):
     """Assign each ZIP to exactly one state using within + centroid method"""
     print("🎯 Assigning ZIPs to states using 'within' predicate...")
-    
-    # First, try direct 'within' join
-    within_join = gpd.sjoin(zcta_gdf, state_gdf, how='inner', predicate='within')
-    within_join = within_join.drop(columns=['index_right'])
-    
-    print(f"   {len(within_join)} ZIPs assigned via 'within' predicate")
-    
-    # Find ZIPs that weren't assigned (border-straddling)
-    assigned_zips = set(within_join['GEOID10'])
-    unassigned_zips = zcta_gdf[~zcta_gdf['GEOID10'].isin(assigned_zips)].copy()
-    
-    print(f"   {len(unassigned_zips)} border-straddling ZIPs need centroid assignment")
-    
-    if len(unassigned_zips) > 0:
-        # Calculate centroids for unassigned ZIPs
-        unassigned_centroids = unassigned_zips.copy()
-        unassigned_centroids['geometry'] = unassigned_centroids.geometry.centroid
-        
-        # Join centroids to states using 'within'
-        centroid_join = gpd.sjoin(unassigned_centroids, state_gdf, how='inner', predicate='within')
-        centroid_join = centroid_join.drop(columns=['index_right'])
-        
-        # Restore original geometry for the centroid-assigned ZIPs
-        centroid_join['geometry'] = unassigned_zips.set_index('GEOID10').loc[centroid_join['GEOID10'], 'geometry'].values
-        
-        print(f"   {len(centroid_join)} ZIPs assigned via centroid method")
-        
-        # Combine both assignment methods
-        final_join = pd.concat([within_join, centroid_join], ignore_index=True)
+
+    # One STRtree over the ~50 state polygons serves both queries; the bulk
+    # 'within' query returns paired positional indices directly, skipping the
+    # sjoin merge machinery entirely. Passing predicate= (rather than
+    # post-filtering bbox candidates) also makes shapely prepare the state
+    # polygons once and reuse them across all ~33k candidate tests.
+    tree = shapely.STRtree(state_gdf.geometry.values)
+    z_within, s_within = tree.query(zcta_gdf.geometry.values, predicate='within')
+
+    print(f"   {len(z_within)} ZIPs assigned via 'within' predicate")
+
+    # Find ZIPs that weren't assigned (border-straddling); the tree query
+    # already yields positional indices, so a boolean mask replaces the
+    # set-of-GEOID10 hashing round-trip
+    unmatched_mask = np.ones(len(zcta_gdf), dtype=bool)
+    unmatched_mask[z_within] = False
+    unmatched = np.nonzero(unmatched_mask)[0]
+
+    print(f"   {len(unmatched)} border-straddling ZIPs need centroid assignment")
+
+    if len(unmatched) > 0:
+        # Query the same tree with the centroids of the straddling ZIPs;
+        # shapely.centroid runs on the raw geometry ndarray — no GeoSeries
+        # wrapper in between
+        centroids = shapely.centroid(zcta_gdf.geometry.values[unmatched])
+        z_cent, s_cent = tree.query(centroids, predicate='within')
+
+        print(f"   {len(z_cent)} ZIPs assigned via centroid method")
+
+        # Concatenate the index pairs from both methods; z_cent is relative to
+        # the unmatched subset, so map it back to ZCTA row positions
+        all_z = np.concatenate([z_within, unmatched[z_cent]])
+        all_s = np.concatenate([s_within, s_cent])
     else:
-        final_join = within_join
-    
+        all_z, all_s = z_within, s_within
+
+    # One take builds the result, carrying the original polygon geometry for
+    # centroid-assigned rows — no per-method frames, no pd.concat
+    final_join = zcta_gdf.iloc[all_z].reset_index(drop=True)
+    final_join[['STATEFP', 'STUSPS']] = state_gdf.iloc[all_s][['STATEFP', 'STUSPS']].to_numpy()
+
     print(f"   Total assigned: {len(final_join)} ZIPs to states")
-    
+
     # Check for any remaining unassigned ZIPs
-    final_assigned = set(final_join['GEOID10'])
-    still_unassigned = len(zcta_gdf) - len(final_assigned)
-    
+    still_unassigned = len(zcta_gdf) - len(final_join)
+
     if still_unassigned > 0:
         print(f"   ⚠️  {still_unassigned} ZIPs could not be assigned to any state")
-    
+
     return final_join
 
+def join_cache_path():
+    """Cache location for the ZIP-state assignment.
+
+    Keyed by everything the cached frame bakes in: the two input shapefile
+    mtimes, the reference layer's mtime (it drives the state filter), and the
+    pipeline CRS — so changing any of them invalidates the cache.
+    """
+    zcta_shp = f"{ZCTA_BASE_NAME}.shp"
+    state_shp = os.path.join(STATE_DIR, f"{STATE_BASE_NAME}.shp")
+    key = hashlib.sha1("|".join([
+        str(os.path.getmtime(zcta_shp)),
+        str(os.path.getmtime(state_shp)),
+        str(os.path.getmtime(REFERENCE_GPKG)),
+        PIPELINE_CRS,
+    ]).encode()).hexdigest()[:12]
+    return os.path.join(OUTPUT_DIR, ".cache", f"join_{key}.parquet")
+
+def load_cached_join():
+    """Return the cached ZIP-state assignment, or None when it is missing or stale"""
+    cache_path = join_cache_path()
+
+    if not os.path.exists(cache_path):
+        return None
+
+    cached = gpd.read_parquet(cache_path)
+    # Belt and braces: a cache written in any other CRS would feed the
+    # meter-unit simplify tolerance degree coordinates downstream
+    if cached.crs != PIPELINE_CRS:
+        cached_crs = cached.crs.to_string() if cached.crs else "None"
+        print(f"   ⚠️  Cached assignment CRS {cached_crs} != {PIPELINE_CRS}; recomputing")
+        return None
+
+    print(f"♻️  Loading cached ZIP-state assignment: {cache_path}")
+    return cached
+
+def assign_zips_to_states_cached(zcta_gdf, state_gdf):
+    """Run assign_zips_to_states, short-circuiting to a Parquet cache when the inputs are unchanged"""
+    cached = load_cached_join()
+    if cached is not None:
+        return cached
+
+    joined_gdf = assign_zips_to_states(zcta_gdf, state_gdf)
+
+    cache_path = join_cache_path()
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Prune superseded keys — every input touch would otherwise leak a
+    # full-dataset parquet in out/.cache
+    for old_cache in Path(cache_dir).glob("join_*.parquet"):
+        old_cache.unlink()
+    joined_gdf.to_parquet(cache_path)
+    print(f"   💾 Cached ZIP-state assignment: {cache_path}")
+
+    return joined_gdf
+
 def dissolve_and_validate(joined_gdf):
     """Dissolve by state and ZIP3, then validate geometry"""
     print("🔄 Dissolving by State × ZIP3...")
-    
-    # Group by state and ZIP3, then dissolve
-    dissolved_gdf = joined_gdf.dissolve(by=['STUSPS', 'ZIP3']).reset_index()
-    
+
+    geoms = joined_gdf.geometry.values
+
+    # Factorize the (state, ZIP3) pair into int codes once — grouping on ints
+    # skips re-hashing object-dtype strings — then bucket row positions with a
+    # stable argsort + prefix-sum split. STUSPS is always 2 chars, so the
+    # combined key splits back unambiguously.
+    codes, uniques = pd.factorize(joined_gdf['STUSPS'].str.cat(joined_gdf['ZIP3']), sort=False)
+    order = np.argsort(codes, kind='stable')
+    boundaries = np.cumsum(np.bincount(codes))[:-1]
+    buckets = np.split(order, boundaries)
+
+    # The per-group unions are independent and shapely 2 releases the GIL
+    # inside GEOS, so run them on a thread pool instead of dissolve()
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        unions = list(pool.map(lambda idx: shapely.unary_union(geoms[idx]), buckets))
+
+    dissolved_gdf = gpd.GeoDataFrame(
+        {
+            'STUSPS': [key[:2] for key in uniques],
+            'ZIP3': [key[2:] for key in uniques],
+        },
+        geometry=gpd.GeoSeries(unions, crs=joined_gdf.crs),
+    )
+
     # Fix any invalid geometries created by dissolve
-    print("🔧 Fixing geometry issues...")
-    invalid_before = (~dissolved_gdf.geometry.is_valid).sum()
-    if invalid_before > 0:
-        print(f"   Found {invalid_before} invalid geometries, applying buffer(0) fix...")
-        dissolved_gdf['geometry'] = dissolved_gdf['geometry'].buffer(0)
-        
-        invalid_after = (~dissolved_gdf.geometry.is_valid).sum()
-        if invalid_after > 0:
-            print(f"   ⚠️  {invalid_after} geometries still invalid after buffer fix")
-        else:
-            print("   ✅ All geometries are now valid")
-    
-    # Keep only the required columns
-    dissolved_gdf = dissolved_gdf[['STUSPS', 'ZIP3', 'geometry']].copy()
-    
+    dissolved_gdf = fix_invalid_geometries(dissolved_gdf)
+
     print(f"   Created {len(dissolved_gdf)} dissolved polygons")
     
     return dissolved_gdf
@@ -176,33 +265,33 @@ def dissolve_and_validate(joined_gdf):
 def simplify_geometry_optional(gdf):
     """Optional geometry simplification for performance"""
     print("⚡ Simplifying geometry for performance...")
-    
-    original_crs = gdf.crs
-    
-    # Convert to equal-area projection for simplification
-    gdf_albers = gdf.to_crs('EPSG:5070')  # Albers Equal Area
-    
-    # Simplify with 75m tolerance
-    gdf_albers['geometry'] = gdf_albers['geometry'].simplify(tolerance=75)
-    
-    # Convert back to original CRS
-    gdf_simplified = gdf_albers.to_crs(original_crs)
-    
+
+    # The pipeline already runs in PIPELINE_CRS (meters), so the 75m tolerance
+    # applies directly. One pass over the geometry ndarray: vectorized
+    # simplify, then make_valid only on anything the simplification broke.
+    geoms = shapely.simplify(gdf.geometry.values, tolerance=75, preserve_topology=True)
+    invalid = ~shapely.is_valid(geoms)
+    if invalid.any():
+        geoms[invalid] = shapely.make_valid(geoms[invalid])
+
+    gdf_simplified = gdf.copy()
+    gdf_simplified['geometry'] = gpd.GeoSeries(geoms, index=gdf.index, crs=gdf.crs)
+
     return gdf_simplified
 
-def validate_coverage(gdf, state_gdf):
+def validate_coverage(gdf):
     """Validate that coverage is ≤ 105% and report statistics"""
     print("📊 Validating coverage...")
-    
-    # Convert to equal-area projection for accurate area calculations
-    gdf_area = gdf.to_crs('EPSG:5070')
-    state_area = state_gdf.to_crs('EPSG:5070')
-    
+
+    # Area math needs the equal-area projection; the pipeline already runs in
+    # it, so this is normally a no-op
+    gdf_area = gdf if gdf.crs == PIPELINE_CRS else gdf.to_crs(PIPELINE_CRS)
+
     # Calculate ZIP3 areas by state
-    zip3_by_state = gdf_area.dissolve(by='STUSPS').area
-    
-    # Calculate original state areas
-    state_areas = state_area.set_index('STUSPS').area
+    zip3_by_state = area_by_state(gdf_area)
+
+    # Original state areas, cached to CSV after the first run
+    state_areas = get_state_areas()
     
     # Calculate coverage for common states
     common_states = list(set(zip3_by_state.index) & set(state_areas.index))
@@ -235,23 +324,32 @@ def validate_coverage(gdf, state_gdf):
     
     return coverage
 
-def export_results(gdf):
+def export_results(gdf, output_crs=None):
     """Export trimmed results to GeoPackage and Shapefile"""
     print("💾 Exporting trimmed results...")
-    
+
+    # Reproject back to the reference CRS once, only for export
+    if output_crs is not None and gdf.crs != output_crs:
+        print(f"   Reprojecting output from {gdf.crs} to {output_crs}")
+        gdf = gdf.to_crs(output_crs)
+
     # Create output directory
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    
+
     # Export to GeoPackage
     gpkg_path = os.path.join(OUTPUT_DIR, "state_zip3_trimmed.gpkg")
-    gdf.to_file(gpkg_path, layer="zip3_state", driver="GPKG")
+    gdf.to_file(gpkg_path, layer="zip3_state", driver="GPKG", engine=IO_ENGINE)
     print(f"   ✅ GeoPackage saved: {gpkg_path} (layer: zip3_state)")
     
-    # Export to Shapefile
-    shp_path = os.path.join(OUTPUT_DIR, "state_zip3_trimmed.shp")
-    gdf.to_file(shp_path)
-    print(f"   ✅ Shapefile saved: {shp_path}")
-    
+    # Export to Shapefile (opt-in)
+    shp_path = None
+    if WRITE_SHAPEFILE:
+        shp_path = os.path.join(OUTPUT_DIR, "state_zip3_trimmed.shp")
+        gdf.to_file(shp_path, engine=IO_ENGINE)
+        print(f"   ✅ Shapefile saved: {shp_path}")
+    else:
+        print("   ℹ️  Shapefile export skipped (rerun with --with-shp to enable)")
+
     return gpkg_path, shp_path
 
 def print_summary(gdf, coverage, elapsed_time):
@@ -284,13 +382,16 @@ def main():
     check_input_files()
     
     # Step 2: Load reference data for CRS and state list
-    target_crs, existing_states = load_reference_data()
-    
-    # Step 3: Load raw ZCTA and state data
-    zcta_gdf, state_gdf = load_and_prepare_raw_data(target_crs, existing_states)
-    
-    # Step 4: Assign ZIPs to states using within + centroid method
-    joined_gdf = assign_zips_to_states(zcta_gdf, state_gdf)
+    reference_crs, existing_states = load_reference_data()
+
+    # Steps 3-4: On a cache hit the run is I/O-bound on a single Parquet
+    # read — skip the ~33k-polygon ZCTA load and reprojection entirely.
+    # On a miss, load the raw inputs in the equal-area CRS (so simplification
+    # and coverage validation need no further reprojection) and assign.
+    joined_gdf = load_cached_join()
+    if joined_gdf is None:
+        zcta_gdf, state_gdf = load_and_prepare_raw_data(PIPELINE_CRS, existing_states)
+        joined_gdf = assign_zips_to_states_cached(zcta_gdf, state_gdf)
     
     # Step 5: Dissolve by state and ZIP3
     dissolved_gdf = dissolve_and_validate(joined_gdf)
@@ -299,10 +400,10 @@ def main():
     simplified_gdf = simplify_geometry_optional(dissolved_gdf)
     
     # Step 7: Validate coverage ≤ 105%
-    coverage = validate_coverage(simplified_gdf, state_gdf)
+    coverage = validate_coverage(simplified_gdf)
     
     # Step 8: Export results
-    export_results(simplified_gdf)
+    export_results(simplified_gdf, output_crs=reference_crs)
     
     # Step 9: Print summary
     elapsed_time = time.time() - start_time
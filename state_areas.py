@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Shared per-state total-area lookup, cached to a small CSV
+
+Every coverage script needs the total EPSG:5070 area of each state, which
+otherwise costs a state-shapefile read, a reprojection, and a GEOS area pass
+per run. Compute it once and persist the ~50-row result to
+out/state_areas_5070.csv.
+"""
+
+import os
+import geopandas as gpd
+import pandas as pd
+
+STATE_SHP = "state_shp/cb_2018_us_state_500k.shp"
+CACHE_CSV = "out/state_areas_5070.csv"
+
+def get_state_areas():
+    """Return total state areas (EPSG:5070, m²) as a Series indexed by STUSPS"""
+    if os.path.exists(CACHE_CSV):
+        return pd.read_csv(CACHE_CSV, index_col="STUSPS")["area"]
+
+    state_bounds = gpd.read_file(STATE_SHP, engine="pyogrio", use_arrow=True,
+                                 columns=["STUSPS"]).to_crs(5070)
+    areas = state_bounds.set_index("STUSPS").area.rename("area")
+
+    os.makedirs(os.path.dirname(CACHE_CSV), exist_ok=True)
+    areas.to_csv(CACHE_CSV)
+
+    return areas
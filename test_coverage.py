@@ -6,6 +6,8 @@ Quick test to analyze ZIP3 coverage by state
 import geopandas as gpd
 import pandas as pd
 
+from zip3_common import area_by_state
+
 def test_zip3_coverage():
     """Test ZIP3 coverage by state using equal-area projection"""
     print("🔍 Testing ZIP3 coverage by state...")
@@ -14,18 +16,20 @@ def test_zip3_coverage():
     try:
         # Load the dissolved layer
         print("📂 Loading dissolved layer...")
-        gdf = gpd.read_file("out/state_zip3_dissolved.gpkg").to_crs(5070)  # equal-area
+        gdf = gpd.read_file("out/state_zip3_dissolved.gpkg", engine="pyogrio", use_arrow=True).to_crs(5070)  # equal-area
         print(f"   Loaded {len(gdf)} polygons")
         
         # Calculate % of each state that has a ZIP-3 polygon
         print("📊 Calculating coverage by state...")
         
         # Get total area by state from ZIP3 polygons
-        zip3_area_by_state = gdf.dissolve(by="STUSPS").area
-        
-        # Get unique state geometries and their total areas
+        zip3_area_by_state = area_by_state(gdf)
+
+        # Get unique state geometries and their total areas; after
+        # drop_duplicates there is one row per state, so a union would be a
+        # no-op — take the areas directly
         state_geometries = gdf[['STUSPS','geometry']].drop_duplicates('STUSPS')
-        total_area_by_state = state_geometries.dissolve(by='STUSPS').area
+        total_area_by_state = state_geometries.set_index('STUSPS').geometry.area
         
         # Calculate coverage percentage
         coverage = (zip3_area_by_state / total_area_by_state).sort_values()
@@ -6,6 +6,9 @@ Fixed coverage test - debugging the area calculation issue
 import geopandas as gpd
 import pandas as pd
 
+from state_areas import get_state_areas
+from zip3_common import union_area_by_state
+
 def debug_coverage_calculation():
     """Debug the coverage calculation to fix the percentage issue"""
     print("🔍 Debugging ZIP3 coverage calculation...")
@@ -14,34 +17,30 @@ def debug_coverage_calculation():
     try:
         # Load the dissolved layer
         print("📂 Loading dissolved layer...")
-        gdf = gpd.read_file("out/state_zip3_dissolved.gpkg").to_crs(5070)  # equal-area
+        gdf = gpd.read_file("out/state_zip3_dissolved.gpkg", engine="pyogrio", use_arrow=True).to_crs(5070)  # equal-area
         print(f"   Loaded {len(gdf)} polygons")
         
         print("\n🔧 Debugging area calculations...")
         
         # Method 1: Original approach (problematic)
         print("Method 1 (Original):")
-        zip3_area_by_state = gdf.dissolve(by="STUSPS").area
+        zip3_area_by_state = union_area_by_state(gdf)
         state_geometries = gdf[['STUSPS','geometry']].drop_duplicates('STUSPS')
-        total_area_by_state = state_geometries.dissolve(by='STUSPS').area
+        total_area_by_state = union_area_by_state(state_geometries)
         
         print(f"   ZIP3 dissolved area sample: {zip3_area_by_state.head(3)}")
         print(f"   State total area sample: {total_area_by_state.head(3)}")
         
-        # Method 2: Load state boundaries separately for comparison
+        # Method 2: Use original state boundary areas (cached to CSV)
         print("\nMethod 2 (Using original state boundaries):")
-        state_bounds = gpd.read_file("state_shp/cb_2018_us_state_500k.shp").to_crs(5070)
-        state_bounds = state_bounds[['STUSPS', 'geometry']].set_index('STUSPS')
-        
-        print(f"   Original state area sample: {state_bounds.area.head(3)}")
-        
+        original_state_areas = get_state_areas()
+
+        print(f"   Original state area sample: {original_state_areas.head(3)}")
+
         # Method 3: Correct calculation
         print("\nMethod 3 (Corrected):")
         # Get ZIP3 areas by state
-        zip3_by_state = gdf.dissolve(by="STUSPS").area
-        
-        # Get original state areas
-        original_state_areas = state_bounds.area
+        zip3_by_state = union_area_by_state(gdf)
         
         # Calculate coverage only for states that exist in both datasets
         common_states = list(set(zip3_by_state.index) & set(original_state_areas.index))
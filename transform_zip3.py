@@ -15,29 +15,46 @@ Requirements:
 - GeoPandas ≥0.14, pyogrio, Pandas, and Requests
 
 Output:
-- ./out/state_zip3_trimmed.shp
 - ./out/state_zip3_trimmed.gpkg (layer="zip3_state")
+- ./out/state_zip3_trimmed.shp (only when run with --with-shp)
 """
 
+import io
 import os
 import sys
 import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 from pathlib import Path
 import warnings
 import urllib3
+
+from zip3_common import (
+    IO_ENGINE,
+    OUTPUT_DIR,
+    STATE_BASE_NAME,
+    STATE_DIR,
+    ZCTA_BASE_NAME,
+    extract_zip3,
+    fix_invalid_geometries,
+    read_file,
+)
 warnings.filterwarnings('ignore')
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 # Configuration
-ZCTA_BASE_NAME = "cb_2018_us_zcta510_500k"
 STATE_URL = "https://www2.census.gov/geo/tiger/GENZ2018/shp/cb_2018_us_state_500k.zip"
-STATE_DIR = "state_shp"
-OUTPUT_DIR = "out"
-STATE_BASE_NAME = "cb_2018_us_state_500k"
+STATE_PARQUET = os.path.join(STATE_DIR, "states.parquet")
+# Shapefile output duplicates the GeoPackage and truncates column names;
+# keep it opt-in for anyone who still needs the legacy format
+WRITE_SHAPEFILE = "--with-shp" in sys.argv
+# ~100m at mid-US latitudes; the Census layers ship in geographic coordinates
+SIMPLIFY_TOLERANCE_DEG = 0.0009
 
 def check_zcta_files():
     """Safety check: verify ZCTA files exist"""
@@ -62,57 +79,108 @@ def download_state_boundaries():
     
     if os.path.exists(state_shp_path):
         print("✅ State boundary files already exist")
-        return
-    
-    print("📥 Downloading state boundary shapefile...")
-    os.makedirs(STATE_DIR, exist_ok=True)
-    
+    else:
+        print("📥 Downloading state boundary shapefile...")
+        os.makedirs(STATE_DIR, exist_ok=True)
+
+        try:
+            # Handle SSL issues that may occur with some environments
+            response = requests.get(STATE_URL, verify=False)
+            response.raise_for_status()
+
+            print("📦 Extracting state boundary files...")
+            # Extract straight from the response buffer — the ~2MB archive never
+            # touches disk, only the extracted shapefile components do (other
+            # scripts read them from STATE_DIR)
+            with zipfile.ZipFile(io.BytesIO(response.content)) as zip_ref:
+                zip_ref.extractall(STATE_DIR)
+
+            print("✅ State boundary files downloaded and extracted")
+
+        except requests.RequestException as e:
+            print(f"❌ ERROR: Failed to download state boundaries: {e}")
+            sys.exit(1)
+        except zipfile.BadZipFile as e:
+            print(f"❌ ERROR: Invalid zip file downloaded: {e}")
+            sys.exit(1)
+
+    # Cache the layer as GeoParquet so later runs read one columnar file
+    # instead of re-parsing the shapefile trio on every start
+    if not os.path.exists(STATE_PARQUET):
+        read_file(state_shp_path).to_parquet(STATE_PARQUET, compression='zstd')
+        print(f"   💾 Cached state boundaries: {STATE_PARQUET}")
+
+def run_duckdb_pipeline():
+    """Opt-in: run the whole transform as one DuckDB-Spatial statement.
+
+    DuckDB columnarizes the geometries, caches their MBRs, and parallelizes
+    the spatial join and coverage-union aggregation across all cores in C++.
+    Note the join semantics differ slightly from the Python path:
+    border-straddling ZCTAs are split across every state they intersect
+    instead of being assigned whole to the state containing their centroid.
+    """
     try:
-        # Handle SSL issues that may occur with some environments
-        response = requests.get(STATE_URL, stream=True, verify=False)
-        response.raise_for_status()
-        
-        zip_path = os.path.join(STATE_DIR, "states.zip")
-        with open(zip_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        print("📦 Extracting state boundary files...")
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(STATE_DIR)
-        
-        # Clean up zip file
-        os.remove(zip_path)
-        print("✅ State boundary files downloaded and extracted")
-        
-    except requests.RequestException as e:
-        print(f"❌ ERROR: Failed to download state boundaries: {e}")
-        sys.exit(1)
-    except zipfile.BadZipFile as e:
-        print(f"❌ ERROR: Invalid zip file downloaded: {e}")
+        import duckdb
+    except ImportError:
+        print("❌ ERROR: --duckdb requires the duckdb package (pip install duckdb)")
         sys.exit(1)
 
+    print("🦆 Running DuckDB-Spatial pipeline...")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    gpkg_path = os.path.join(OUTPUT_DIR, "state_zip3_trimmed.gpkg")
+    state_shp_path = os.path.join(STATE_DIR, f"{STATE_BASE_NAME}.shp")
+
+    duckdb.sql(f"""
+        INSTALL spatial; LOAD spatial;
+        CREATE TABLE z AS
+            SELECT substr(GEOID10, 1, 3) AS ZIP3, geom
+            FROM ST_Read('{ZCTA_BASE_NAME}.shp');
+        CREATE TABLE s AS
+            SELECT STUSPS, geom
+            FROM ST_Read('{state_shp_path}');
+        COPY (
+            SELECT s.STUSPS, z.ZIP3,
+                   ST_SimplifyPreserveTopology(
+                       ST_CoverageUnion_Agg(ST_Intersection(z.geom, s.geom)),
+                       {SIMPLIFY_TOLERANCE_DEG}) AS geom
+            FROM z JOIN s ON ST_Intersects(z.geom, s.geom)
+            GROUP BY s.STUSPS, z.ZIP3
+        ) TO '{gpkg_path}'
+        WITH (FORMAT GDAL, DRIVER 'GPKG', LAYER_NAME 'zip3_state');
+    """)
+
+    print(f"   ✅ GeoPackage saved: {gpkg_path} (layer: zip3_state)")
+
 def load_and_prepare_data():
     """Load both shapefiles and prepare data"""
     print("📊 Loading ZCTA data...")
     
-    # Load ZCTA data
-    zcta_gdf = gpd.read_file(f"{ZCTA_BASE_NAME}.shp")
+    # Load ZCTA data; column pushdown means the unused DBF attributes are
+    # never materialized (on the Fiona fallback the slice below still applies)
+    zcta_gdf = read_file(f"{ZCTA_BASE_NAME}.shp", columns=['GEOID10'])
     print(f"   Loaded {len(zcta_gdf)} ZCTA polygons")
-    
-    # Keep only required columns and add ZIP3
-    zcta_gdf = zcta_gdf[['GEOID10', 'geometry']].copy()
-    zcta_gdf['ZIP3'] = zcta_gdf['GEOID10'].str[:3]
-    
-    # Load state data
+
+    # On the Fiona fallback every DBF column was read — drop the extras
+    # (pyogrio's columns= pushdown already returned just GEOID10 + geometry,
+    # and re-slicing would copy the 33k-element geometry array for nothing)
+    if IO_ENGINE != "pyogrio":
+        zcta_gdf = zcta_gdf[['GEOID10', 'geometry']]
+    zcta_gdf['ZIP3'] = extract_zip3(zcta_gdf['GEOID10'])
+
+    # Load state data, preferring the GeoParquet cache written at download
+    # time (no WKB row-by-row decode, geometry arrives as one Arrow column)
     print("📊 Loading state boundary data...")
-    state_shp_path = os.path.join(STATE_DIR, f"{STATE_BASE_NAME}.shp")
-    state_gdf = gpd.read_file(state_shp_path)
+    if os.path.exists(STATE_PARQUET):
+        state_gdf = gpd.read_parquet(STATE_PARQUET, columns=['STATEFP', 'STUSPS', 'geometry'])
+    else:
+        state_shp_path = os.path.join(STATE_DIR, f"{STATE_BASE_NAME}.shp")
+        state_gdf = read_file(state_shp_path, columns=['STATEFP', 'STUSPS'])
     print(f"   Loaded {len(state_gdf)} state polygons")
-    
-    # Keep only required state columns
-    state_gdf = state_gdf[['STATEFP', 'STUSPS', 'geometry']].copy()
-    
+
+    # Both loaders above are column-pruned; only the Fiona fallback needs the slice
+    if IO_ENGINE != "pyogrio":
+        state_gdf = state_gdf[['STATEFP', 'STUSPS', 'geometry']]
+
     return zcta_gdf, state_gdf
 
 def ensure_same_crs(zcta_gdf, state_gdf):
@@ -135,26 +203,40 @@ def spatial_join_and_clip(zcta_gdf, state_gdf):
     """Assign ZIPs to states and clip to state boundaries (border-trimmed approach)"""
     print("🎯 Assigning ZIPs to states using 'within' predicate...")
     
-    # First, try spatial join with 'within' predicate for clean assignments
-    within_join = gpd.sjoin(zcta_gdf, state_gdf, how='inner', predicate='within')
-    within_join = within_join.drop(columns=['index_right'])
+    # One STRtree over the ~50 state polygons serves both the polygon and the
+    # centroid queries; the paired positional indices drive plain iloc takes
+    # instead of sjoin's build-index/merge/drop-column machinery
+    tree = shapely.STRtree(state_gdf.geometry.values)
+
+    z_within, s_within = tree.query(zcta_gdf.geometry.values, predicate='within')
+    within_join = zcta_gdf.iloc[z_within].reset_index(drop=True)
+    within_join[['STATEFP', 'STUSPS']] = state_gdf.iloc[s_within][['STATEFP', 'STUSPS']].to_numpy()
     print(f"   {len(within_join)} ZIPs assigned via 'within' predicate")
     
-    # Find ZIPs that straddle state boundaries (not captured by 'within')
-    assigned_zips = set(within_join['GEOID10'])
-    straddling_zips = zcta_gdf[~zcta_gdf['GEOID10'].isin(assigned_zips)].copy()
+    # Find ZIPs that straddle state boundaries (not captured by 'within').
+    # z_within already holds their row positions, so flip a boolean mask
+    # instead of hashing 33k GEOID10 strings through isin
+    straddling_mask = np.ones(len(zcta_gdf), dtype=bool)
+    straddling_mask[z_within] = False
+    # boolean indexing already yields a fresh frame — no extra .copy() pass
+    # over the geometry object array needed
+    straddling_zips = zcta_gdf[straddling_mask]
     print(f"   {len(straddling_zips)} border-straddling ZIPs need centroid assignment")
     
-    # For straddling ZIPs, use centroid-based assignment
+    # For straddling ZIPs, use centroid-based assignment against the same tree
     if len(straddling_zips) > 0:
-        centroids = straddling_zips.copy()
-        centroids['geometry'] = centroids.geometry.centroid
-        centroid_join = gpd.sjoin(centroids, state_gdf, how='inner', predicate='within')
-        centroid_join = centroid_join.drop(columns=['index_right'])
-        
-        # Restore original geometry for centroid-assigned ZIPs
-        centroid_join['geometry'] = straddling_zips.set_index('GEOID10').loc[centroid_join['GEOID10'], 'geometry'].values
-        
+        # shapely.centroid runs once over the raw geometry ndarray instead of
+        # dispatching through the GeoSeries accessor per element; the query
+        # needs only the bare centroid array, not a centroid-geometry frame
+        centroids = shapely.centroid(straddling_zips.geometry.values)
+        z_cent, s_cent = tree.query(centroids, predicate='within')
+
+        # z_cent is positional within the straddler frame, so an iloc take
+        # carries the original polygon geometry directly — no string-keyed
+        # set_index/.loc restore pass afterwards
+        centroid_join = straddling_zips.iloc[z_cent].reset_index(drop=True)
+        centroid_join[['STATEFP', 'STUSPS']] = state_gdf.iloc[s_cent][['STATEFP', 'STUSPS']].to_numpy()
+
         print(f"   {len(centroid_join)} ZIPs assigned via centroid method")
         
         # Combine both assignment methods
@@ -169,23 +251,34 @@ def spatial_join_and_clip(zcta_gdf, state_gdf):
     if total_unassigned > 0:
         print(f"   ⚠️  {total_unassigned} ZIPs could not be assigned to any state")
     
-    # Now clip ZIP geometries to state boundaries
+    # Now clip ZIP geometries to state boundaries. Rows assigned via the
+    # 'within' predicate are already entirely inside their state, so
+    # intersection would hand them back unchanged — skip GEOS for that
+    # interior majority (a cheaper but weaker prefilter would be MBR
+    # containment; the join result is both exact and already computed) and
+    # run one vectorized pairwise intersection over just the straddlers.
+    # (Each ZIP is still clipped only to its assigned state — an
+    # overlay(how='intersection') would instead split straddlers across every
+    # state they touch, changing the layer's semantics.)
     print("✂️  Clipping ZIP geometries to state boundaries...")
-    clipped_parts = []
-    
-    for state in state_gdf['STUSPS'].unique():
-        state_geom = state_gdf[state_gdf['STUSPS'] == state].geometry.iloc[0]
-        state_zips = all_assigned[all_assigned['STUSPS'] == state].copy()
-        
-        if len(state_zips) > 0:
-            # Clip ZIPs to state boundary
-            state_zips['geometry'] = state_zips.geometry.intersection(state_geom)
-            clipped_parts.append(state_zips)
-    
-    if clipped_parts:
-        clipped_gdf = pd.concat(clipped_parts, ignore_index=True)
-        # Remove any empty geometries created by clipping
-        clipped_gdf = clipped_gdf[~clipped_gdf.geometry.is_empty].copy()
+
+    clipped_gdf = all_assigned.copy()
+    needs_clip = np.zeros(len(all_assigned), dtype=bool)
+    needs_clip[len(within_join):] = True
+    print(f"   {int((~needs_clip).sum())} interior ZIPs skip clipping; {int(needs_clip.sum())} get intersected")
+
+    if needs_clip.any():
+        state_geoms = state_gdf.geometry.values
+        state_pos = pd.Series(np.arange(len(state_gdf)), index=state_gdf['STUSPS'])
+        per_row_state = state_geoms[state_pos[all_assigned.loc[needs_clip, 'STUSPS']].to_numpy()]
+        clipped_gdf.loc[needs_clip, 'geometry'] = shapely.intersection(
+            all_assigned.geometry.values[needs_clip], per_row_state
+        )
+
+    # Remove any empty geometries created by clipping
+    clipped_gdf = clipped_gdf[~clipped_gdf.geometry.is_empty].reset_index(drop=True)
+
+    if len(clipped_gdf) > 0:
         print(f"   Clipped to {len(clipped_gdf)} state-constrained ZIP polygons")
         return clipped_gdf
     else:
@@ -193,40 +286,56 @@ def spatial_join_and_clip(zcta_gdf, state_gdf):
         return gpd.GeoDataFrame()
 
 def dissolve_by_state_zip3(clipped_gdf):
-    """Dissolve by state and ZIP3 to create final trimmed polygons"""
-    print("🔄 Dissolving by State × ZIP3...")
-    
-    # Group by state and ZIP3, then dissolve
-    dissolved_gdf = clipped_gdf.dissolve(by=['STUSPS', 'ZIP3']).reset_index()
-    
-    print("🔧 Fixing geometry issues...")
-    # Fix any invalid geometries created by dissolve
-    dissolved_gdf['geometry'] = dissolved_gdf['geometry'].buffer(0)
-    
-    # Keep only the required columns
-    dissolved_gdf = dissolved_gdf[['STUSPS', 'ZIP3', 'geometry']].copy()
-    
+    """Dissolve by state and ZIP3 and simplify in one fused pass"""
+    print("🔄 Dissolving and simplifying by State × ZIP3...")
+
+    # ~50 states × ~900 prefixes: cast the keys to category so the groupby
+    # hashes small int codes instead of re-hashing object-dtype strings;
+    # observed=True keeps empty (state, prefix) combinations out
+    clipped_gdf = clipped_gdf.astype({'STUSPS': 'category', 'ZIP3': 'category'})
+
+    geoms = clipped_gdf.geometry.values
+    groups = clipped_gdf.groupby(['STUSPS', 'ZIP3'], sort=False, observed=True).indices
+
+    # ZCTAs clipped to one state form a clean coverage (shared edges, no
+    # overlaps), so GEOS CoverageUnion can merge each group in roughly linear
+    # time instead of running a full unary union. Simplifying the merged
+    # result in the same step means each group's coordinate arrays are
+    # traversed once — no intermediate dissolved-but-unsimplified GeoSeries.
+    def union_and_simplify(idx):
+        try:
+            merged = shapely.coverage_union_all(geoms[idx])
+        except shapely.errors.GEOSException:
+            # Clipping emits polygon+line GeometryCollections when a
+            # straddler's edge runs along the state boundary, and
+            # CoverageUnion rejects mixed-dimension input — fall back to the
+            # full union for such groups
+            merged = shapely.unary_union(geoms[idx])
+        return shapely.simplify(merged, tolerance=SIMPLIFY_TOLERANCE_DEG, preserve_topology=True)
+
+    # The groups are independent and shapely 2 releases the GIL inside GEOS,
+    # so fan the fused union+simplify out over a thread pool
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        dissolved = list(pool.map(union_and_simplify, groups.values()))
+
+    keys = list(groups)
+    dissolved_gdf = gpd.GeoDataFrame(
+        {
+            'STUSPS': [state for state, _ in keys],
+            'ZIP3': [zip3 for _, zip3 in keys],
+        },
+        geometry=gpd.GeoSeries(dissolved, crs=clipped_gdf.crs),
+    )
+    
+    dissolved_gdf = fix_invalid_geometries(dissolved_gdf)
+
+    # The frame is constructed with exactly STUSPS, ZIP3, geometry — no
+    # trailing column slice (and copy) needed
+
     print(f"   Created {len(dissolved_gdf)} dissolved polygons")
     
     return dissolved_gdf
 
-def simplify_geometry(gdf):
-    """Simplify geometry for better performance (optional)"""
-    print("⚡ Simplifying geometry for performance...")
-    
-    original_crs = gdf.crs
-    
-    # Convert to Web Mercator for simplification
-    gdf_mercator = gdf.to_crs('EPSG:3857')
-    
-    # Simplify with 100m tolerance
-    gdf_mercator['geometry'] = gdf_mercator['geometry'].simplify(tolerance=100)
-    
-    # Convert back to original CRS
-    gdf_simplified = gdf_mercator.to_crs(original_crs)
-    
-    return gdf_simplified
-
 def export_results(gdf):
     """Export trimmed results to both shapefile and GeoPackage"""
     print("💾 Exporting trimmed results...")
@@ -234,16 +343,29 @@ def export_results(gdf):
     # Create output directory
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     
-    # Export to shapefile
-    shp_path = os.path.join(OUTPUT_DIR, "state_zip3_trimmed.shp")
-    gdf.to_file(shp_path)
-    print(f"   ✅ Shapefile saved: {shp_path}")
-    
     # Export to GeoPackage
     gpkg_path = os.path.join(OUTPUT_DIR, "state_zip3_trimmed.gpkg")
-    gdf.to_file(gpkg_path, layer="zip3_state", driver="GPKG")
+    if IO_ENGINE == "pyogrio":
+        import pyogrio
+
+        # write_dataframe with use_arrow batch-encodes geometries and
+        # attributes through GDAL's Arrow writer instead of row-by-row;
+        # promote_to_multi keeps the layer a uniform MultiPolygon type
+        pyogrio.write_dataframe(
+            gdf, gpkg_path, layer="zip3_state", driver="GPKG",
+            use_arrow=True, promote_to_multi=True,
+        )
+    else:
+        gdf.to_file(gpkg_path, layer="zip3_state", driver="GPKG")
     print(f"   ✅ GeoPackage saved: {gpkg_path} (layer: zip3_state)")
-    
+
+    # Shapefile is opt-in — it duplicates every polygon already in the GPKG
+    shp_path = None
+    if WRITE_SHAPEFILE:
+        shp_path = os.path.join(OUTPUT_DIR, "state_zip3_trimmed.shp")
+        gdf.to_file(shp_path, engine=IO_ENGINE)
+        print(f"   ✅ Shapefile saved: {shp_path}")
+
     return shp_path, gpkg_path
 
 def print_summary(gdf, processing_time=None):
@@ -277,7 +399,13 @@ def main():
     
     # Step 2: Download state boundaries if needed
     download_state_boundaries()
-    
+
+    # Optional all-SQL path: run everything inside DuckDB-Spatial
+    if "--duckdb" in sys.argv:
+        run_duckdb_pipeline()
+        print(f"Processing time: {time.time() - start_time:.1f} seconds")
+        return
+
     # Step 3: Load and prepare data
     zcta_gdf, state_gdf = load_and_prepare_data()
     
@@ -287,18 +415,15 @@ def main():
     # Step 5: Spatial join and clip to state boundaries
     clipped_gdf = spatial_join_and_clip(zcta_gdf, state_gdf)
     
-    # Step 6: Dissolve by state and ZIP3
+    # Step 6: Dissolve by state and ZIP3 (simplification happens in the same pass)
     dissolved_gdf = dissolve_by_state_zip3(clipped_gdf)
-    
-    # Step 7: Simplify geometry (optional)
-    simplified_gdf = simplify_geometry(dissolved_gdf)
-    
-    # Step 8: Export results
-    export_results(simplified_gdf)
-    
-    # Step 9: Print summary with timing
+
+    # Step 7: Export results
+    export_results(dissolved_gdf)
+
+    # Step 8: Print summary with timing
     processing_time = time.time() - start_time
-    print_summary(simplified_gdf, processing_time)
+    print_summary(dissolved_gdf, processing_time)
 
 if __name__ == "__main__":
     main()